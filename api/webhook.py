@@ -5,10 +5,36 @@ import hmac
 import hashlib
 import os
 import requests
+from requests.adapters import HTTPAdapter
 import re
+import string
 import time
-import traceback
+import logging
 import io
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# 优先使用 orjson 解析/序列化 JSON（直接处理 bytes，速度更快），不可用时回退到标准库
+try:
+    import orjson
+    json_loads = orjson.loads
+    json_dumps = orjson.dumps
+except ImportError:
+    orjson = None
+    json_loads = json.loads
+
+    def json_dumps(obj):
+        return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode()
+
+# 可选：用 requests_toolbelt 的 MultipartEncoder 流式上传文件，避免 multipart 正文在内存中再复制一份
+try:
+    from requests_toolbelt.multipart.encoder import MultipartEncoder
+except ImportError:
+    MultipartEncoder = None
+
+# 异常堆栈交给 logging 输出（未配置 handler 时写到 stderr），其余日志仍使用 print
+logger = logging.getLogger(__name__)
 
 # -------------------------
 # 配置与环境变量
@@ -18,17 +44,59 @@ BOT_TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN')
 CHAT_ID = os.environ.get('TELEGRAM_CHAT_ID')
 # 可选：用于通过 GitHub API 查询与下载 assets（推荐在 Vercel 环境变量中设置）
 GITHUB_TOKEN = os.environ.get('GITHUB_TOKEN')  # 可以使用 GITHUB_TOKEN 或 PAT
+# 可选：设置 WEBHOOK_DEBUG=1 打印逐个 asset 的调试信息
+DEBUG = os.environ.get('WEBHOOK_DEBUG') == '1'
 
 if not (SECRET_TOKEN and BOT_TOKEN and CHAT_ID):
     raise RuntimeError("关键环境变量缺失: 请设置 GITHUB_WEBHOOK_SECRET, TELEGRAM_BOT_TOKEN, TELEGRAM_CHAT_ID")
 
+# Telegram Bot API 地址只需拼接一次
+TELEGRAM_SEND_MESSAGE_URL = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
+TELEGRAM_SEND_DOCUMENT_URL = f"https://api.telegram.org/bot{BOT_TOKEN}/sendDocument"
+
+# 签名密钥只需编码一次
+SECRET_TOKEN_BYTES = SECRET_TOKEN.encode()
+# 预先完成 HMAC 的密钥处理（ipad/opad），每个请求只需 copy() 后 update()
+# digestmod 传 hashlib.sha256（OpenSSL 构造函数）而非字符串，hmac 会直接使用 OpenSSL 的 HMAC 实现（含 SHA-NI 加速）
+_HMAC_TEMPLATE = hmac.new(SECRET_TOKEN_BYTES, None, hashlib.sha256)
+# hashlib.sha256 由 _hashlib（OpenSSL）提供时 hmac 才能走 OpenSSL 路径，否则给出提示
+if getattr(hashlib.sha256, '__module__', None) != '_hashlib':
+    print("⚠️ 当前 Python 的 hashlib 未链接 OpenSSL，签名校验将走较慢的纯 Python 路径")
+SIGNATURE_PREFIX = 'sha256='
+SIGNATURE_PREFIX_LEN = len(SIGNATURE_PREFIX)
+SIGNATURE_DIGEST_SIZE = _HMAC_TEMPLATE.digest_size
+
 # 常量
+VALID_PATHS = frozenset(("/api/webhook", "/webhook"))
 MAX_CONTENT_LENGTH = 1024 * 1024  # 1MB for webhook payload
+READ_CHUNK_SIZE = 64 * 1024  # 分块读取请求体的大小
 ANY_KERNEL_PATTERN = re.compile(r'any.*kernel', re.IGNORECASE)
+# 在原始 body 上预扫描 "name": "...any...kernel..." 字段，未命中说明 payload 中不可能有匹配的 asset
+ANY_KERNEL_NAME_BYTES_PATTERN = re.compile(rb'"name"\s*:\s*"[^"]*any[^"]*kernel', re.IGNORECASE)
+PUBLISHED_ACTION_BYTES_PATTERN = re.compile(rb'"action"\s*:\s*"published"')
+# 仅在忽略投递时用于取出 action 名称写入日志
+ACTION_BYTES_PATTERN = re.compile(rb'"action"\s*:\s*"([^"]*)"')
 TELEGRAM_MAX_MESSAGE_LENGTH = 4000
-MAX_RETRY_ATTEMPTS = 4
-RETRY_DELAY = 2  # seconds
+# safe_markdown 使用的替换表：单次 C 级扫描代替多次 str.replace
+SAFE_MARKDOWN_TABLE = str.maketrans({'`': "'", '*': '×', '[': '(', ']': ')'})
+SAFE_MARKDOWN_PATTERN = re.compile(r'[`*\[\]]')
+
+# 新版本通知消息模板（导入时编译一次）
+RELEASE_MESSAGE_TEMPLATE = string.Template(
+    "🔔 **新版本发布通知**\n\n"
+    "📦 仓库: [$repo_full]($repo_url)\n"
+    "🏷 版本: [$tag_name]($release_url) - $release_name\n"
+    "👤 发布者: [$login]($sender_url)\n"
+    "📅 发布时间: $published_at\n\n"
+    "$body"
+)
+# 未找到匹配 asset 时重新查询 GitHub API 前的等待（指数退避），总计 3.5s，给 GitHub 的 10s 投递超时留出余量
+ASSET_RETRY_DELAYS = (0.5, 1, 2)  # seconds
+RETRY_DELAY = 2  # seconds, Telegram 429 时最多等待这么久后重试一次（未给出 retry_after 时也按此等待）
 TELEGRAM_MAX_UPLOAD_BYTES = 20 * 1024 * 1024  # 20MB
+# Telegram 对同一会话的限制约为 1 条/秒（允许短时突发），所有请求只发往 CHAT_ID，一个令牌桶即可
+TELEGRAM_CHAT_RATE = 1  # tokens per second
+TELEGRAM_CHAT_BURST = 3
 
 # GitHub API headers (用于 fetch assets / 下载)
 GITHUB_API_HEADERS = {
@@ -37,48 +105,126 @@ GITHUB_API_HEADERS = {
 }
 if GITHUB_TOKEN:
     GITHUB_API_HEADERS['Authorization'] = f'token {GITHUB_TOKEN}'
+# 通过 assets API 直接获取二进制时需 Accept: application/octet-stream
+GITHUB_API_OCTET_HEADERS = {**GITHUB_API_HEADERS, 'Accept': 'application/octet-stream'}
+# browser_download_url 直接下载时使用的 headers
+BROWSER_DOWNLOAD_HEADERS = {'User-Agent': 'Mozilla/5.0'}
+
+# 复用连接（keep-alive + 连接池），避免每次请求都重新进行 TCP/TLS 握手
+# Vercel 在热启动时会复用进程，连接池可跨多次 webhook 投递保留
+SESSION = requests.Session()
+SESSION.headers['User-Agent'] = GITHUB_API_HEADERS['User-Agent']
+SESSION.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=0))
+# 进程级线程池，所有请求共用，避免每个请求都创建/销毁线程
+EXECUTOR = ThreadPoolExecutor(max_workers=4)
+
+# 成功响应的正文
+OK_BODY = b'OK'
+
+# 自行序列化 JSON 请求体时使用的 headers
+JSON_HEADERS = {'Content-Type': 'application/json'}
+
+# 已成功处理的 X-GitHub-Delivery（有上限的 LRU），用于忽略重复投递
+# Vercel 的进程是短暂且多实例的，这里只是尽力去重
+_SEEN_DELIVERIES = OrderedDict()
+_SEEN_DELIVERIES_LOCK = threading.Lock()
+SEEN_DELIVERIES_MAX = 512
+
+# fetch_release_assets 的响应缓存: url -> (时间戳, ETag, assets)
+# TTL 需小于 ASSET_RETRY_DELAYS 中的最小值，否则重试时只会拿到旧结果；过期后依靠 ETag 重新验证
+_ASSETS_CACHE = {}
+ASSETS_CACHE_TTL = 0.4  # seconds
 
 
 # -------------------------
 # Handler
 # -------------------------
 class handler(BaseHTTPRequestHandler):
+    # 响应写入带缓冲的 wfile，状态行、头和正文在请求处理结束时一次性发出，而不是每次 write 一个系统调用
+    wbufsize = -1
+
     def do_POST(self):
-        valid_paths = ["/api/webhook", "/webhook"]
-        if self.path not in valid_paths:
-            self.send_error(404, f"路径无效: {self.path}")
+        if self.path not in VALID_PATHS:
+            self.send_error(404, "Not Found", f"路径无效: {self.path}")
             print(f"❌ 非法路径请求: {self.path}")
             return
 
+        # 每个请求头只读取一次，且只取一次 self.headers 属性
+        headers = self.headers
+
         # 验证 X-Hub-Signature-256
-        signature_header = self.headers.get('X-Hub-Signature-256')
+        signature_header = headers.get('X-Hub-Signature-256')
         if not signature_header:
-            self.send_error(403, "缺少签名")
+            self.send_error(403, "Forbidden", "缺少签名")
             print("❌ 缺少 X-Hub-Signature-256 头")
             return
+        # 解析为 32 字节原始摘要，直接按字节比较，省去 hex 编码与字符串拼接
+        received_digest = b''
+        if signature_header.startswith(SIGNATURE_PREFIX):
+            try:
+                received_digest = bytes.fromhex(signature_header[SIGNATURE_PREFIX_LEN:])
+            except ValueError:
+                pass
+        if len(received_digest) != SIGNATURE_DIGEST_SIZE:
+            self.send_error(403, "Forbidden", "签名格式无效")
+            print(f"❌ 签名格式无效: {signature_header}")
+            return
 
-        # 检查长度
-        try:
-            content_length = int(self.headers.get('Content-Length', '0'))
-        except:
-            content_length = 0
+        # 检查长度（缺失或不是纯 ASCII 数字时直接拒绝，而不是按 0 字节处理）
+        content_length_header = headers.get('Content-Length')
+        if not content_length_header or not (content_length_header.isascii() and content_length_header.isdecimal()):
+            self.send_error(411, "Length Required", "缺少有效的 Content-Length")
+            print(f"❌ Content-Length 无效: {content_length_header}")
+            return
+        content_length = int(content_length_header)
         if content_length > MAX_CONTENT_LENGTH:
-            self.send_error(413, "请求体过大")
+            self.send_error(413, "Payload Too Large", "请求体过大")
             print("❌ webhook payload 过大")
             return
+        # 只处理 JSON 格式的 payload（GitHub webhook 的 Content type 需设为 application/json），
+        # 在读取请求体之前拒绝，不为其分配缓冲区
+        content_type = headers.get('Content-Type', '')
+        if content_type.partition(';')[0].strip().lower() != 'application/json':
+            self.send_error(415, "Unsupported Media Type", "仅支持 application/json")
+            print(f"❌ 不支持的 Content-Type: {content_type}")
+            return
+
+        # 边读取边计算签名，避免整块读入后再做一次完整遍历
+        body, body_digest = self._read_and_hmac(content_length)
+        if not hmac.compare_digest(received_digest, body_digest):
+            print(f"❌ 签名无效. 收到: {signature_header}  预期: {SIGNATURE_PREFIX}{body_digest.hex()}")
+            self.send_error(403, "Forbidden", "签名无效")
+            return
 
-        body = self.rfile.read(content_length)
-        expected_signature = 'sha256=' + hmac.new(SECRET_TOKEN.encode(), body, hashlib.sha256).hexdigest()
-        if not hmac.compare_digest(signature_header, expected_signature):
-            print(f"❌ 签名无效. 收到: {signature_header}  预期: {expected_signature}")
-            self.send_error(403, "签名无效")
+        # GitHub 重投递（超时/5xx 后）使用相同的 X-GitHub-Delivery，已成功处理过的直接返回；
+        # 放在读取请求体并验证签名之后：既不会在未读完 body 时关闭连接，也不让未签名的请求查询去重表
+        delivery_id = headers.get('X-GitHub-Delivery')
+        if delivery_id and is_delivery_seen(delivery_id):
+            print(f"ℹ️ 重复投递，已忽略: {delivery_id}")
+            self.send_ok()
+            return
+
+        # 先用请求头和字节级扫描过滤掉非 release published 的投递，省去完整的 JSON 解析
+        # （字节扫描只是预过滤，解析后仍会再次检查 action）
+        event = headers.get('X-GitHub-Event')
+        if event != 'release':
+            print(f"ℹ️ 忽略事件: {event}")
+            self.send_ok()
+            return
+        if not PUBLISHED_ACTION_BYTES_PATTERN.search(body):
+            m = ACTION_BYTES_PATTERN.search(body)
+            action = m.group(1).decode(errors='replace') if m else None
+            print(f"ℹ️ 忽略 release action: {action}（非 published）")
+            self.send_ok()
             return
 
+        payload_may_match = ANY_KERNEL_NAME_BYTES_PATTERN.search(body) is not None
+
         try:
-            data = json.loads(body)
+            data = json_loads(body)
         except Exception as e:
             print(f"❌ 无法解析 JSON: {e}")
-            self.send_error(400, "无效的 JSON")
+            self.send_error(400, "Bad Request", "无效的 JSON")
             return
 
         try:
@@ -86,9 +232,7 @@ class handler(BaseHTTPRequestHandler):
             if action != 'published':
                 # 仅关心 release published 事件（可根据需要拓展）
                 print(f"ℹ️ 忽略 action: {action}")
-                self.send_response(200)
-                self.end_headers()
-                self.wfile.write(b'OK')
+                self.send_ok()
                 return
 
             repo = data.get('repository', {})
@@ -97,57 +241,26 @@ class handler(BaseHTTPRequestHandler):
 
             repo_full = repo.get('full_name', 'unknown/repo')
             tag_name = release.get('tag_name', 'unknown')
+            release_url = release.get('html_url', '')
             print(f"📦 收到 Release published: {repo_full} {tag_name}")
 
             # 构建通知消息并发送（支持分段）
-            message = (
-                f"🔔 **新版本发布通知**\n\n"
-                f"📦 仓库: [{repo_full}]({repo.get('html_url', '')})\n"
-                f"🏷 版本: [{tag_name}]({release.get('html_url','')}) - {release.get('name','')}\n"
-                f"👤 发布者: [{sender.get('login','')}]({sender.get('html_url','')})\n"
-                f"📅 发布时间: {release.get('published_at','')}\n\n"
-                f"{release.get('body','')}"
+            message = RELEASE_MESSAGE_TEMPLATE.substitute(
+                repo_full=repo_full,
+                repo_url=repo.get('html_url', ''),
+                tag_name=tag_name,
+                release_url=release_url,
+                release_name=release.get('name') or '',
+                login=sender.get('login', ''),
+                sender_url=sender.get('html_url', ''),
+                published_at=release.get('published_at', ''),
+                body=release.get('body') or '',
             )
-            self.send_telegram_message_safe(message)
-
-            # 查找匹配的 asset（先用 payload，再用 API 主动查询）
-            matched_asset = None
-            assets = []
-
-            for attempt in range(1, MAX_RETRY_ATTEMPTS + 1):
-                assets = release.get('assets', []) or []
-                print(f"🔄 (尝试 #{attempt}) payload 中发现 {len(assets)} 个 asset")
-
-                # 如果 payload 里没有 asset，或未找到匹配项，主动通过 GitHub API 再查一次 release
-                if not assets:
-                    print("🔎 payload 未含 assets 或为空，尝试使用 GitHub API 查询 release assets...")
-                    api_assets = fetch_release_assets(repo_full, release_id=release.get('id'), tag_name=tag_name)
-                    if api_assets is not None:
-                        assets = api_assets
-                        print(f"🔁 从 API 查询到 {len(assets)} 个 asset")
-                    else:
-                        print("⚠️ API 查询失败或无返回")
-
-                # 打印调试信息
-                for i, a in enumerate(assets):
-                    an = a.get('name', '')
-                    sz = a.get('size', 0)
-                    print(f"  asset[{i}]: {an} ({sz//1024 if sz else '未知'} KB)")
-
-                # 找到第一个匹配 ANY_KERNEL_PATTERN 的 asset
-                for a in assets:
-                    an = a.get('name', '')
-                    if an and ANY_KERNEL_PATTERN.search(an):
-                        matched_asset = a
-                        print(f"🎯 匹配到 asset: {an}")
-                        break
-
-                if matched_asset:
-                    break
-
-                if attempt < MAX_RETRY_ATTEMPTS:
-                    print(f"⏳ 未找到匹配 asset，等待 {RETRY_DELAY}s 后重试...")
-                    time.sleep(RETRY_DELAY)
+            # 通知消息发往 Telegram、asset 查询发往 GitHub，两者互不依赖，并行执行以隐藏一次 RTT
+            msg_future = EXECUTOR.submit(self.send_telegram_message_safe, message)
+            matched_asset = self.find_matching_asset(repo_full, release, payload_may_match)
+            # 附件必须在通知之后发送，先等待通知完成（返回 200 前也需确保已发出，否则 Vercel 会终止后台线程）
+            msg_future.result()
 
             # 处理匹配到的 asset
             if matched_asset:
@@ -161,18 +274,101 @@ class handler(BaseHTTPRequestHandler):
                     "2. 附件名称不符合模式\n"
                     "3. 发布未包含内核刷机包\n\n"
                     "请检查 GitHub 发布页面：\n"
-                    f"[{tag_name} 发布页面]({release.get('html_url','')})"
+                    f"[{tag_name} 发布页面]({release_url})"
                 )
                 self.send_telegram_message(no_asset_msg)
 
-            self.send_response(200)
-            self.end_headers()
-            self.wfile.write(b'OK')
+            if delivery_id:
+                mark_delivery_seen(delivery_id)
+            self.send_ok()
 
         except Exception as e:
-            print(f"❌ 处理错误: {e}")
-            traceback.print_exc()
-            self.send_error(500, f"服务器内部错误: {e}")
+            logger.exception("❌ 处理错误: %s", e)
+            self.send_error(500, "Internal Server Error", f"服务器内部错误: {e}")
+
+    def send_ok(self):
+        """
+        返回 200 OK；带上 Content-Length 便于连接复用，头和正文经 wfile 缓冲后一起写出
+        """
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(OK_BODY)))
+        self.end_headers()
+        self.wfile.write(OK_BODY)
+
+    # -------------------------
+    # 查找匹配的 asset（先用 payload，再用 API 主动查询）
+    # -------------------------
+    def find_matching_asset(self, repo_full, release, payload_may_match=True):
+        """
+        payload_may_match 为 False 时表示原始 body 预扫描未命中，
+        payload 里的 assets 不必再逐个匹配，直接通过 API 查询。
+        """
+        tag_name = release.get('tag_name', 'unknown')
+        matched_asset = None
+        search = ANY_KERNEL_PATTERN.search
+        release_id = release.get('id')
+        # payload 中的 assets 不会变化，只在第一次尝试时使用；之后的重试都通过 API 查询最新列表
+        assets = (release.get('assets') or []) if payload_may_match else []
+        print(f"🔄 payload 中发现 {len(assets)} 个候选 asset")
+
+        for attempt in range(len(ASSET_RETRY_DELAYS) + 1):
+            # payload 里没有 asset，或上一次未找到匹配项，主动通过 GitHub API 再查一次 release
+            if attempt or not assets:
+                print(f"🔎 (尝试 #{attempt + 1}) 使用 GitHub API 查询 release assets...")
+                api_assets = fetch_release_assets(repo_full, release_id=release_id, tag_name=tag_name)
+                if api_assets is not None:
+                    assets = api_assets
+                    print(f"🔁 从 API 查询到 {len(assets)} 个 asset")
+                else:
+                    print("⚠️ API 查询失败或无返回")
+
+            # 打印调试信息（仅在 DEBUG 打开时），所有 asset 合并为一次输出
+            if DEBUG and assets:
+                print("\n".join(
+                    f"  asset[{i}]: {a.get('name', '')} ({sz//1024 if (sz := a.get('size')) else '未知'} KB)"
+                    for i, a in enumerate(assets)
+                ))
+
+            # 找到第一个匹配 ANY_KERNEL_PATTERN 的 asset；
+            # 不含 'kernel' 的名称（源码包、校验文件等）必然不匹配，先用子串判断跳过正则；
+            # 常见的 'anykernel' 字面名称必然匹配，同样无需走正则
+            matched_asset = next(
+                (a for a in assets
+                 if (an := a.get('name')) and 'kernel' in (low := an.lower())
+                 and ('anykernel' in low or search(an))),
+                None,
+            )
+            if matched_asset:
+                print(f"🎯 匹配到 asset: {matched_asset['name']}")
+                break
+
+            if attempt < len(ASSET_RETRY_DELAYS):
+                delay = ASSET_RETRY_DELAYS[attempt]
+                print(f"⏳ 未找到匹配 asset，等待 {delay}s 后重试...")
+                time.sleep(delay)
+
+        return matched_asset
+
+    def _read_and_hmac(self, n):
+        """
+        分块读取 n 字节请求体，同时增量更新 HMAC-SHA256。
+        直接 readinto 预分配的缓冲区，不产生中间 bytes 副本。
+        返回 (body bytearray, 原始摘要 bytes)。
+        """
+        mac = _HMAC_TEMPLATE.copy()
+        buf = bytearray(n)
+        received = 0
+        with memoryview(buf) as view:
+            while received < n:
+                got = self.rfile.readinto(view[received:received + READ_CHUNK_SIZE])
+                if not got:
+                    break
+                mac.update(view[received:received + got])
+                received += got
+        if received < n:
+            del buf[received:]
+        return buf, mac.digest()
 
     # -------------------------
     # 处理单个 asset
@@ -189,41 +385,56 @@ class handler(BaseHTTPRequestHandler):
         print(f"  浏览器下载链接: {asset_browser_url}")
         print(f"  API 链接: {asset_api_url}")
 
-        # 尝试通过 API 下载（优先），若失败回退到 browser_download_url
+        description = f"内核刷机包: {release.get('tag_name','')}"
+
+        # 先让 Telegram 直接从 browser_download_url 拉取文件，文件不经过本函数中转；
+        # Telegram 按 URL 发送文档只支持 ZIP/PDF/GIF，刷机包均为 zip。私有仓库等情况下会失败，再走下载上传
+        if (asset_browser_url and (asset_name or '').lower().endswith('.zip')
+                and (asset_size or 0) <= TELEGRAM_MAX_UPLOAD_BYTES):
+            if send_telegram_document_by_url(asset_browser_url, description):
+                print("✅ asset 已通过 URL 发送到 Telegram")
+                return
+            print("⚠️ URL 发送失败，改为下载后上传")
+
+        # 以流的方式打开下载（优先 API，失败回退到 browser_download_url），
+        # 直接把响应流交给 sendDocument，避免先把整个文件读入内存
         try:
-            content_bytes = download_asset_content(asset)
+            resp = open_asset_stream(asset)
         except Exception as e:
-            print(f"❌ 通过 API 下载 asset 失败: {e}")
-            content_bytes = None
-
-        # 如果用 API 下载失败但 browser_download_url 存在，则尝试直接下载
-        if content_bytes is None and asset_browser_url:
-            try:
-                print("⬇️ 回退到 browser_download_url 下载（可能需要公有仓库或 token）")
-                r = requests.get(asset_browser_url, headers={'User-Agent': 'Mozilla/5.0'}, timeout=30)
-                r.raise_for_status()
-                content_bytes = r.content
-                r.close()
-            except Exception as e:
-                print(f"❌ 回退下载失败: {e}")
-                content_bytes = None
+            print(f"❌ 下载 asset 失败: {e}")
+            resp = None
 
         # 检查大小并上传到 Telegram
-        if content_bytes:
-            size_b = len(content_bytes)
-            if size_b <= TELEGRAM_MAX_UPLOAD_BYTES:
-                try:
-                    description = f"内核刷机包: {release.get('tag_name','')}"
-                    ok = send_telegram_document_bytes(asset_name, content_bytes, description)
-                    if ok:
-                        print("✅ asset 已成功上传到 Telegram")
-                        return
-                    else:
-                        print("⚠️ 上传到 Telegram 返回失败")
-                except Exception as e:
-                    print(f"❌ 上传到 Telegram 发生异常: {e}")
-            else:
-                print(f"⚠️ 文件过大，无法通过 Telegram 上传: {size_b/(1024*1024):.2f}MB")
+        if resp is not None:
+            with resp:
+                # 以下载响应的 Content-Length 为准（有 Content-Encoding 时它是压缩后的长度，不可用），
+                # payload 中的 size 只在响应未给出长度时使用，两者不一致时按失败处理
+                header_len = resp.headers.get('Content-Length')
+                if header_len and header_len.isdecimal() and not resp.headers.get('Content-Encoding'):
+                    size_b = int(header_len)
+                else:
+                    size_b = asset_size or 0
+                if asset_size and size_b != asset_size:
+                    print(f"⚠️ asset 大小不一致: payload {asset_size} 字节，下载响应 {size_b} 字节")
+                elif size_b > TELEGRAM_MAX_UPLOAD_BYTES:
+                    print(f"⚠️ 文件过大，无法通过 Telegram 上传: {size_b/(1024*1024):.2f}MB")
+                else:
+                    try:
+                        if size_b:
+                            resp.raw.decode_content = True
+                            content = resp.raw
+                        else:
+                            # 大小未知时无法流式上传，分块读入内存，超过上限立即中止
+                            content = read_capped(resp, TELEGRAM_MAX_UPLOAD_BYTES)
+                            size_b = len(content)
+                        ok = send_telegram_document(asset_name, content, description, size=size_b)
+                        if ok:
+                            print("✅ asset 已成功上传到 Telegram")
+                            return
+                        else:
+                            print("⚠️ 上传到 Telegram 返回失败")
+                    except Exception as e:
+                        print(f"❌ 上传到 Telegram 发生异常: {e}")
 
         # 如果到这里仍然没有成功，发送 fallback 消息包含下载链接
         fallback_msg = (
@@ -236,47 +447,73 @@ class handler(BaseHTTPRequestHandler):
     # 文本发送与分段
     # -------------------------
     def send_telegram_message_safe(self, text):
-        if len(text) <= TELEGRAM_MAX_MESSAGE_LENGTH:
+        limit = TELEGRAM_MAX_MESSAGE_LENGTH
+        text_len = len(text)
+        if text_len <= limit:
             return self.send_telegram_message(text)
-        print(f"⚠️ 文本过长({len(text)}字符)，将分段发送")
+        print(f"⚠️ 文本过长({text_len}字符)，将分段发送")
         messages = []
-        current = ""
+        current = []
+        current_len = 0
+
+        def flush():
+            chunk = "\n".join(current).strip()
+            if chunk:
+                messages.append(chunk)
+
         for line in text.splitlines():
-            if len(current) + len(line) + 1 <= TELEGRAM_MAX_MESSAGE_LENGTH:
-                current += line + "\n"
+            line_len = len(line) + 1
+            if current_len + line_len <= limit:
+                current.append(line)
+                current_len += line_len
             else:
-                if current:
-                    messages.append(current.strip())
-                if len(line) > TELEGRAM_MAX_MESSAGE_LENGTH:
+                flush()
+                if line_len > limit + 1:
                     # 强制切分
-                    chunks = [line[i:i+TELEGRAM_MAX_MESSAGE_LENGTH] for i in range(0, len(line), TELEGRAM_MAX_MESSAGE_LENGTH)]
-                    messages.extend(chunks)
-                    current = ""
+                    messages.extend(line[i:i + limit] for i in range(0, line_len - 1, limit))
+                    current = []
+                    current_len = 0
                 else:
-                    current = line + "\n"
-        if current.strip():
-            messages.append(current.strip())
-        for i, msg in enumerate(messages):
-            prefix = f"📄 消息分段 ({i+1}/{len(messages)})\n\n" if len(messages) > 1 else ""
+                    current = [line]
+                    current_len = line_len
+        flush()
+        # 分段必须按顺序送达，不能并行发送；发送间隔由 TELEGRAM_BUCKET 控制
+        total = len(messages)
+        for i, msg in enumerate(messages, 1):
+            prefix = f"📄 消息分段 ({i}/{total})\n\n" if total > 1 else ""
             self.send_telegram_message(prefix + msg)
-            time.sleep(0.3)
         return True
 
     def safe_markdown(self, text):
         if not text:
             return ""
-        return text.replace('`', "'").replace('*', '×').replace('[', '(').replace(']', ')')
+        # 绝大多数文件名不含需替换的字符，先用正则预检，命中时才构建新字符串
+        if not SAFE_MARKDOWN_PATTERN.search(text):
+            return text
+        return text.translate(SAFE_MARKDOWN_TABLE)
 
     def send_telegram_message(self, text):
-        url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
+        url = TELEGRAM_SEND_MESSAGE_URL
         payload = {
             'chat_id': CHAT_ID,
             'text': text,
             'parse_mode': 'Markdown',
             'disable_web_page_preview': True
         }
+        data = json_dumps(payload)
         try:
-            r = requests.post(url, json=payload, timeout=10)
+            TELEGRAM_BUCKET.acquire()
+            r = SESSION.post(url, data=data, headers=JSON_HEADERS, timeout=10)
+            retry_after = telegram_retry_after(r)
+            if retry_after is not None and retry_after > RETRY_DELAY:
+                # 等待过久会超出 GitHub 的 10s 投递超时和函数时限，直接按失败处理
+                print(f"⚠️ Telegram 限流，retry_after={retry_after}s 过长，不再重试")
+            elif retry_after is not None:
+                # 被限流时按 Telegram 给出的 retry_after 等待后重发一次
+                print(f"⏳ Telegram 限流，{retry_after}s 后重试")
+                time.sleep(retry_after)
+                TELEGRAM_BUCKET.acquire()
+                r = SESSION.post(url, data=data, headers=JSON_HEADERS, timeout=10)
             r.raise_for_status()
             print(f"✅ 发送消息成功 ({len(text)} 字符)")
             return True
@@ -290,11 +527,34 @@ class handler(BaseHTTPRequestHandler):
 # -------------------------
 # 辅助函数（类外，以便复用）
 # -------------------------
+def is_delivery_seen(delivery_id):
+    """
+    判断该投递是否已成功处理过，命中时刷新其 LRU 位置
+    """
+    with _SEEN_DELIVERIES_LOCK:
+        if delivery_id in _SEEN_DELIVERIES:
+            _SEEN_DELIVERIES.move_to_end(delivery_id)
+            return True
+        return False
+
+
+def mark_delivery_seen(delivery_id):
+    """
+    记录已成功处理的投递，超出上限时淘汰最久未使用的记录
+    """
+    with _SEEN_DELIVERIES_LOCK:
+        _SEEN_DELIVERIES[delivery_id] = None
+        _SEEN_DELIVERIES.move_to_end(delivery_id)
+        while len(_SEEN_DELIVERIES) > SEEN_DELIVERIES_MAX:
+            _SEEN_DELIVERIES.popitem(last=False)
+
+
 def fetch_release_assets(repo_full_name, release_id=None, tag_name=None):
     """
     使用 GitHub API 获取 release 的 assets 列表。
     优先使用 release_id，如果没有则使用 tag_name。
     返回 assets 列表（或空列表），出错时返回 None。
+    结果按 URL 做短时缓存，并在过期后用 ETag 条件请求重新验证（304 不消耗 API 配额）。
     """
     try:
         if release_id:
@@ -305,56 +565,163 @@ def fetch_release_assets(repo_full_name, release_id=None, tag_name=None):
             print("❌ fetch_release_assets: 既没有 release_id 也没有 tag_name")
             return None
 
-        resp = requests.get(url, headers=GITHUB_API_HEADERS, timeout=10)
+        cached = _ASSETS_CACHE.get(url)
+        now = time.monotonic()
+        if cached and now - cached[0] < ASSETS_CACHE_TTL:
+            return cached[2]
+
+        headers = GITHUB_API_HEADERS
+        if cached and cached[1]:
+            headers = {**GITHUB_API_HEADERS, 'If-None-Match': cached[1]}
+
+        resp = SESSION.get(url, headers=headers, timeout=10)
+        if resp.status_code == 304 and cached:
+            _ASSETS_CACHE[url] = (now, cached[1], cached[2])
+            return cached[2]
         resp.raise_for_status()
         rel = resp.json()
-        return rel.get('assets', [])
+        assets = rel.get('assets', [])
+        _ASSETS_CACHE[url] = (now, resp.headers.get('ETag'), assets)
+        return assets
     except Exception as e:
         print(f"❌ fetch_release_assets 异常: {e}")
         return None
 
 
-def download_asset_content(asset):
+def open_asset_stream(asset):
     """
+    以 stream=True 打开 asset 的下载响应，调用方负责关闭（可用 with）。
     优先使用 asset['url']（API 地址）并加 Accept: application/octet-stream 来下载二进制内容
-    如果使用 API 下载需要 Authorization（如果仓库是私有或 token 必要）
-    成功返回 bytes，失败抛出异常
+    （私有仓库需要 Authorization），失败时回退到 browser_download_url。
+    成功返回已校验状态码的 Response，失败抛出异常
     """
     asset_api_url = asset.get('url')
     asset_browser_url = asset.get('browser_download_url')
-    headers = GITHUB_API_HEADERS.copy()
-    # 当使用 assets API 直接获取二进制时需 Accept header
-    headers['Accept'] = 'application/octet-stream'
-    try:
-        if asset_api_url:
+    if asset_api_url:
+        try:
             print(f"⬇️ 使用 API 下载 asset: {asset_api_url}")
-            resp = requests.get(asset_api_url, headers=headers, timeout=60, stream=True)
+            resp = SESSION.get(asset_api_url, headers=GITHUB_API_OCTET_HEADERS, timeout=60, stream=True)
             # GitHub 会在此返回二进制流（需要 Authorization 若为私有）
             resp.raise_for_status()
-            content = resp.content
-            resp.close()
-            return content
-        elif asset_browser_url:
-            print(f"⬇️ 使用 browser_download_url 下载 asset: {asset_browser_url}")
-            resp = requests.get(asset_browser_url, headers={'User-Agent': 'Mozilla/5.0'}, timeout=60)
-            resp.raise_for_status()
-            content = resp.content
-            resp.close()
-            return content
-        else:
-            raise RuntimeError("asset 不包含可下载的 url")
-    except Exception as e:
-        raise
+            return resp
+        except Exception as e:
+            print(f"❌ 通过 API 下载 asset 失败: {e}")
+            if not asset_browser_url:
+                raise
+    if asset_browser_url:
+        print(f"⬇️ 使用 browser_download_url 下载 asset: {asset_browser_url}")
+        resp = SESSION.get(asset_browser_url, headers=BROWSER_DOWNLOAD_HEADERS, timeout=60, stream=True)
+        resp.raise_for_status()
+        return resp
+    raise RuntimeError("asset 不包含可下载的 url")
 
 
-def send_telegram_document_bytes(filename, content_bytes, caption):
+def telegram_retry_after(resp):
     """
-    把 bytes 内容作为文件上传到 Telegram
+    Telegram 返回 429 时从响应中取出 retry_after（秒），否则返回 None
     """
-    url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendDocument"
-    files = {
-        'document': (filename or 'file.bin', content_bytes)
+    if resp.status_code != 429:
+        return None
+    try:
+        return int(resp.json()['parameters']['retry_after'])
+    except Exception:
+        return RETRY_DELAY
+
+
+def read_capped(resp, limit):
+    """
+    以 READ_CHUNK_SIZE 分块读取流式响应，累计超过 limit 字节时抛出 ValueError，
+    峰值内存不超过 limit 加一个分块。返回读取到的 bytes
+    """
+    buf = io.BytesIO()
+    total = 0
+    for chunk in resp.iter_content(READ_CHUNK_SIZE):
+        total += len(chunk)
+        if total > limit:
+            raise ValueError(f"文件超过 {limit/(1024*1024):.0f}MB 上限")
+        buf.write(chunk)
+    return buf.getvalue()
+
+
+class TokenBucket:
+    """
+    线程安全的令牌桶：按 rate 个/秒补充，最多积累 capacity 个。
+    acquire() 在锁内预约令牌（允许透支为负数），在锁外睡眠，多个线程按调用顺序依次放行
+    """
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.ts = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.ts) * self.rate)
+            self.ts = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+# 所有 Telegram 请求共用的令牌桶（进程级，热启动时跨请求保留）
+TELEGRAM_BUCKET = TokenBucket(TELEGRAM_CHAT_RATE, TELEGRAM_CHAT_BURST)
+
+
+class SizedStream:
+    """
+    为下载响应的 raw 流补充剩余长度（len 属性），供 MultipartEncoder 计算 Content-Length 并按块读取
+    流的实际长度与 length 不一致（提前结束或读完后仍有剩余）时抛出 IOError，中止上传，避免发出截断的文件
+    """
+    def __init__(self, raw, length):
+        self.raw = raw
+        self.len = length
+
+    def read(self, size=-1):
+        if self.len <= 0:
+            return b''
+        chunk = self.raw.read(self.len if size is None or size < 0 else min(size, self.len))
+        if not chunk:
+            raise IOError(f"下载流提前结束，尚有 {self.len} 字节未读取")
+        self.len -= len(chunk)
+        if self.len <= 0 and self.raw.read(1):
+            raise IOError("下载流长度超出预期，文件大小与声明不一致")
+        return chunk
+
+
+def send_telegram_document_by_url(file_url, caption):
+    """
+    以 URL 方式调用 sendDocument，由 Telegram 服务器自行下载文件
+    成功返回 True；Telegram 无法获取该 URL 等失败情况返回 False
+    """
+    payload = {
+        'chat_id': CHAT_ID,
+        'document': file_url,
+        'caption': f"**{caption}**" if caption else '',
+        'parse_mode': 'Markdown',
+        'disable_notification': True
     }
+    try:
+        TELEGRAM_BUCKET.acquire()
+        r = SESSION.post(TELEGRAM_SEND_DOCUMENT_URL, data=json_dumps(payload), headers=JSON_HEADERS, timeout=30)
+        r.raise_for_status()
+        print("✅ sendDocument(URL) 成功")
+        return True
+    except requests.exceptions.RequestException as e:
+        print(f"❌ sendDocument(URL) 失败: {e}")
+        if hasattr(e, 'response') and e.response is not None:
+            print(f"  响应: {e.response.status_code} {e.response.text}")
+        return False
+
+
+def send_telegram_document(filename, content, caption, size=None):
+    """
+    把文件内容上传到 Telegram，content 可以是 bytes 或可读的文件对象（如下载响应的 raw 流）
+    对文件对象传入 size 且安装了 requests_toolbelt 时，边读边上传，不在内存中缓存整个文件
+    """
+    url = TELEGRAM_SEND_DOCUMENT_URL
     data = {
         'chat_id': CHAT_ID,
         'caption': f"**{caption}**" if caption else '',
@@ -362,7 +729,18 @@ def send_telegram_document_bytes(filename, content_bytes, caption):
         'disable_notification': True
     }
     try:
-        r = requests.post(url, files=files, data=data, timeout=60)
+        TELEGRAM_BUCKET.acquire()
+        if MultipartEncoder is not None and (isinstance(content, bytes) or size):
+            body = content if isinstance(content, bytes) else SizedStream(content, size)
+            fields = {k: str(v) for k, v in data.items()}
+            fields['document'] = (filename or 'file.bin', body, 'application/octet-stream')
+            encoder = MultipartEncoder(fields=fields)
+            r = SESSION.post(url, data=encoder, headers={'Content-Type': encoder.content_type}, timeout=120)
+        else:
+            files = {
+                'document': (filename or 'file.bin', content, 'application/octet-stream')
+            }
+            r = SESSION.post(url, files=files, data=data, timeout=120)
         r.raise_for_status()
         print("✅ sendDocument 成功")
         return True